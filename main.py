@@ -18,6 +18,7 @@ from tkinter import messagebox
 import subprocess
 import ctypes
 import re
+import json
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -37,6 +38,11 @@ WAIT_FOR_OPPONENT = 1.5
 DIFF_THRESHOLD = 18 # Pixel difference to detect a move
 MAX_REPETITIONS = 2
 ENGINE_THINK_TIME = 2500  # Increased for much better endgame quality
+ANALYSIS_MODE = False  # Deep analysis: MultiPV lines, costs search depth per move
+ANALYSIS_MULTIPV = 3  # Number of top lines searched/shown in analysis mode
+WIN_PROB_SCALE = 400  # Centipawns per factor-10 change in win odds
+UNSTABLE_SWING = 0.10  # Win-prob swing between depths that flags a position
+ANALYSIS_FOLDER = 'analysis'  # Where finished game timelines are saved
 IMAGE_FOLDER = resource_path('images')
 
 # Piece mapping for internal tracking
@@ -116,6 +122,213 @@ class RedirectText:
     def flush(self):
         pass
 
+# === ENGINE ANALYSIS ===
+INFO_INT_FIELDS = {'depth', 'seldepth', 'multipv', 'nodes', 'nps', 'time', 'hashfull', 'tbhits'}
+
+class InfoRecord:
+    """One parsed UCI 'info' line carrying a principal variation"""
+    __slots__ = ('depth', 'seldepth', 'multipv', 'nodes', 'nps', 'time',
+                 'hashfull', 'tbhits', 'cp', 'mate', 'bound', 'pv')
+
+    def __init__(self):
+        self.depth = self.seldepth = self.nodes = self.nps = self.time = 0
+        self.hashfull = self.tbhits = 0
+        self.multipv = 1
+        self.cp = self.mate = self.bound = None
+        self.pv = []
+
+    def win_prob(self):
+        """Win probability for the side to move"""
+        return win_probability(self.cp, self.mate)
+
+    def score_str(self):
+        if self.mate is not None:
+            return f"M{self.mate}"
+        return f"{(self.cp or 0) / 100:+.2f}"
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        rec = cls()
+        for k in cls.__slots__:
+            if k in data:
+                setattr(rec, k, data[k])
+        return rec
+
+def parse_info_line(line):
+    """
+    Parse a UCI 'info' line into an InfoRecord.
+    Returns None for lines without a scored, depth-tagged PV
+    (currmove, string, hashfull-only...).
+    Single split + linear scan: cheap enough for thousands of lines per second.
+    """
+    if not line.startswith("info") or " pv " not in line:
+        return None
+
+    tokens = line.split()
+    if tokens[1] == "string":
+        return None  # Free text, may mention " pv " without being one
+    rec = InfoRecord()
+    i, n = 1, len(tokens)
+    try:
+        while i < n:
+            key = tokens[i]
+            if key == "pv":
+                rec.pv = tokens[i + 1:]
+                break
+            if key == "score":
+                if tokens[i + 1] == "cp":
+                    rec.cp = int(tokens[i + 2])
+                else:
+                    rec.mate = int(tokens[i + 2])
+                i += 3
+                if i < n and tokens[i] in ("lowerbound", "upperbound"):
+                    rec.bound = tokens[i]
+                    i += 1
+                continue
+            if key in INFO_INT_FIELDS:
+                setattr(rec, key, int(tokens[i + 1]))
+                i += 2
+                continue
+            i += 1
+    except (IndexError, ValueError):
+        return None
+
+    if not rec.pv or not rec.depth or (rec.cp is None and rec.mate is None):
+        return None
+    return rec
+
+def win_probability(cp=None, mate=None):
+    """Logistic mapping of an engine score to a 0-1 win probability"""
+    if mate is not None:
+        return 1.0 if mate > 0 else 0.0
+    if cp is None:
+        return 0.5
+    return 1 / (1 + 10 ** (-cp / WIN_PROB_SCALE))
+
+class SearchAnalysis:
+    """Collects info records of a single search"""
+
+    def __init__(self, fen):
+        self.fen = fen
+        self.red_to_move = fen.split()[1] == 'w' if ' ' in fen else True
+        self.lines = {}        # multipv rank -> latest exact InfoRecord
+        self.depth_best = []   # (depth, move, win_prob) of PV 1 per depth
+        self.best_move = None
+
+    def add(self, rec):
+        if rec.bound:
+            return  # Provisional aspiration-window score, wait for the exact one
+        self.lines[rec.multipv] = rec
+        if rec.multipv == 1:
+            if self.depth_best and self.depth_best[-1][0] == rec.depth:
+                self.depth_best[-1] = (rec.depth, rec.pv[0], rec.win_prob())
+            else:
+                self.depth_best.append((rec.depth, rec.pv[0], rec.win_prob()))
+
+    def top_lines(self):
+        """Final lines ordered by MultiPV rank"""
+        return [self.lines[k] for k in sorted(self.lines)]
+
+    def red_win_prob(self):
+        """Win probability from Red's point of view (None if no score seen)"""
+        top = self.lines.get(1)
+        if top is None:
+            return None
+        p = top.win_prob()
+        return p if self.red_to_move else 1 - p
+
+    def is_unstable(self):
+        """Best move or eval still moving at the last depths -> needs more time"""
+        if len(self.depth_best) < 2:
+            return False
+        (_, prev_move, prev_p), (_, last_move, last_p) = self.depth_best[-2:]
+        return prev_move != last_move or abs(last_p - prev_p) > UNSTABLE_SWING
+
+    def to_dict(self):
+        return {
+            'fen': self.fen,
+            'best_move': self.best_move,
+            'red_win_prob': self.red_win_prob(),
+            'unstable': self.is_unstable(),
+            'lines': [rec.to_dict() for rec in self.top_lines()],
+            'depth_best': self.depth_best,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        search = cls(data['fen'])
+        search.best_move = data.get('best_move')
+        for d in data.get('lines', []):
+            rec = InfoRecord.from_dict(d)
+            search.lines[rec.multipv] = rec
+        search.depth_best = [tuple(d) for d in data.get('depth_best', [])]
+        return search
+
+class GameAnalysis:
+    """Per-game evaluation timeline, shared between the bot thread and the GUI"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timeline = []
+        self.result = None
+        self.saved = None
+        self.started = time.time()
+
+    def record(self, search):
+        with self.lock:
+            if self.result is None:  # A search still running at stop belongs to no game
+                self.timeline.append(search)
+
+    def latest(self):
+        with self.lock:
+            return self.timeline[-1] if self.timeline else None
+
+    def win_probs(self):
+        """
+        Timeline length and (index, Red win probability, unstable) per search
+        that produced a score, taken under one lock so they stay consistent.
+        """
+        with self.lock:
+            probs = [(i, s.red_win_prob(), s.is_unstable()) for i, s in enumerate(self.timeline)]
+        return len(probs), [(i, p, u) for i, p, u in probs if p is not None]
+
+    def critical_positions(self):
+        """Searches whose result was still changing when time ran out"""
+        with self.lock:
+            return [s for s in self.timeline if s.is_unstable()]
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started': self.started,
+                'result': self.result,
+                'timeline': [s.to_dict() for s in self.timeline],
+            }
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+    @classmethod
+    def from_dict(cls, data):
+        game = cls()
+        game.started = data.get('started', game.started)
+        game.timeline = [SearchAnalysis.from_dict(d) for d in data.get('timeline', [])]
+        game.result = data.get('result')
+        return game
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved game timeline for review (e.g. critical_positions())"""
+        with open(path, encoding='utf-8') as f:
+            game = cls.from_dict(json.load(f))
+        game.saved = path
+        return game
+
 # === FAIRY-STOCKFISH ENGINE ===
 class Engine:
     """Fairy-Stockfish engine wrapper with MultiPV support"""
@@ -123,6 +336,7 @@ class Engine:
     def __init__(self):
         self.engine_path = resource_path("fairy-stockfish.exe")
         self.process = None
+        self.analysis_mode = ANALYSIS_MODE
         
     def start(self):
         """Start engine process"""
@@ -174,7 +388,10 @@ class Engine:
         return None
     
     def get_best_move(self, fen, forbidden_moves=None):
-        """Get best move, avoiding forbidden moves using MultiPV"""
+        """
+        Get best move, avoiding forbidden moves using MultiPV.
+        Returns (move, SearchAnalysis); move is None when there is no legal move.
+        """
         if not self.process or self.process.poll() is not None:
             self.start()
         
@@ -182,13 +399,17 @@ class Engine:
         self._send("ucinewgame")
         self._send(f"position fen {fen}")
         
-        # If we have forbidden moves, ask for multiple suggestions
+        # If we have forbidden moves, ask for multiple suggestions.
+        # Analysis mode always asks for the top lines; MultiPV splits the
+        # think time across them, so it searches shallower per move.
         num_pv = 5 if forbidden_moves else 1
+        if self.analysis_mode:
+            num_pv = max(num_pv, ANALYSIS_MULTIPV)
         self._send(f"setoption name MultiPV value {num_pv}")
         self._send(f"go movetime {ENGINE_THINK_TIME}")
         
         best_move = None
-        pv_candidates = []
+        analysis = SearchAnalysis(fen)
         
         start_time = time.time()
         while time.time() - start_time < 15:
@@ -196,28 +417,27 @@ class Engine:
             if not line: continue
             
             # Collect PV lines
-            if " pv " in line:
-                parts = line.split()
-                try:
-                    pv_idx = parts.index("pv")
-                    move = parts[pv_idx + 1]
-                    if move not in pv_candidates and move != "(none)":
-                        pv_candidates.insert(0, move) # Higher PVs usually come later
-                except: pass
+            rec = parse_info_line(line)
+            if rec:
+                analysis.add(rec)
+                continue
             
             # Get result
             if line.startswith("bestmove"):
                 best_move = line.split()[1]
                 break
         
+        analysis.best_move = best_move
+        
         # Check for repetition avoidance
         if forbidden_moves and best_move in forbidden_moves:
-            for candidate in pv_candidates:
-                if candidate not in forbidden_moves:
+            for rec in analysis.top_lines():
+                candidate = rec.pv[0]
+                if candidate != "(none)" and candidate not in forbidden_moves:
                     print(f"[ENGINE] Loop detected. Avoiding {best_move}, choosing {candidate}")
-                    return candidate
+                    return candidate, analysis
                     
-        return best_move if best_move != "(none)" else None
+        return (best_move if best_move != "(none)" else None), analysis
 
 # === COORDINATE CONVERSION ===
 def uci_to_coords(uci_move):
@@ -288,6 +508,7 @@ class XiangqiBot:
         self.scaled_cache = {}
         self.last_screenshot = None
         self.move_history = []
+        self.analysis = GameAnalysis()
         self.engine = Engine()
         self.engine.start()
         self.load_templates()
@@ -439,13 +660,40 @@ class XiangqiBot:
             if self.move_history[-1] == self.move_history[-3]:
                 forbidden.append(self.move_history[-1])
         
-        best_uci = self.engine.get_best_move(fen, forbidden_moves=forbidden)
+        # Bind the timeline now: STOP + AUTO during the search swaps self.analysis
+        game = self.analysis
+        best_uci, search = self.engine.get_best_move(fen, forbidden_moves=forbidden)
+        game.record(search)
         
         if best_uci is None or best_uci == "(none)":
             return "MATE" # Signal that we have no legal moves (Loss)
             
         return uci_to_coords(best_uci)
     
+    def start_game(self):
+        """Begin a fresh evaluation timeline, stamped with the game start time"""
+        self.analysis = GameAnalysis()
+    
+    def finish_game(self, result):
+        """
+        Close the current timeline and save it (one file per game).
+        The finished timeline stays in self.analysis for display until start_game.
+        """
+        analysis = self.analysis
+        with analysis.lock:
+            if analysis.result is not None:
+                return analysis.saved
+            analysis.result = result
+        if analysis.timeline:
+            try:
+                os.makedirs(ANALYSIS_FOLDER, exist_ok=True)
+                name = time.strftime("game_%Y%m%d_%H%M%S.json", time.localtime(analysis.started))
+                analysis.saved = analysis.export_json(os.path.join(ANALYSIS_FOLDER, name))
+                print(f"[ANALYSIS] Saved {analysis.saved} ({len(analysis.critical_positions())} critical positions)")
+            except Exception as e:
+                print(f"[ANALYSIS] Save failed: {e}")
+        return analysis.saved
+    
     def get_game_result(self):
         """Check if either king is missing from the board"""
         red_king_exists = any('general_red' in row for row in self.board)
@@ -477,8 +725,14 @@ class GUI:
         btn_frame = tk.Frame(self.root, bg='#1e1e1e')
         btn_frame.pack(pady=10)
 
-        self.top_btn = tk.Button(btn_frame, text="Stay on Top: OFF", command=self.toggle_topmost, width=15, bg='#444', fg='white')
-        self.top_btn.pack(side=tk.TOP, pady=5)
+        toggle_frame = tk.Frame(btn_frame, bg='#1e1e1e')
+        toggle_frame.pack(side=tk.TOP, pady=5)
+
+        self.top_btn = tk.Button(toggle_frame, text="Stay on Top: OFF", command=self.toggle_topmost, width=15, bg='#444', fg='white')
+        self.top_btn.pack(side=tk.LEFT, padx=5)
+
+        self.analysis_btn = tk.Button(toggle_frame, text="Analysis: OFF", command=self.toggle_analysis, width=18, bg='#444', fg='white')
+        self.analysis_btn.pack(side=tk.LEFT, padx=5)
         
         self.scan_btn = tk.Button(btn_frame, text="SCAN (F5)", command=self.do_scan, width=12, bg='#444', fg='white')
         self.scan_btn.pack(side=tk.LEFT, padx=5)
@@ -489,9 +743,17 @@ class GUI:
         self.stop_btn = tk.Button(btn_frame, text="STOP (F10)", command=self.stop_bot, width=12, bg='#c62828', fg='white', state=tk.DISABLED)
         self.stop_btn.pack(side=tk.LEFT, padx=5)
 
+        # Analysis panel, only packed (and the window enlarged) in analysis mode
+        self.analysis_frame = tk.Frame(self.root, bg='#1e1e1e')
+        self.lines_box = tk.Text(self.analysis_frame, height=ANALYSIS_MULTIPV, bg='#111', fg='#ddd', font=('Consolas', 8))
+        self.lines_box.pack(fill=tk.X)
+        self.graph = tk.Canvas(self.analysis_frame, width=540, height=60, bg='#111', highlightthickness=1, highlightbackground='#333')
+        self.graph.pack(pady=(3, 0))
+
         self.log_box = tk.Text(self.root, height=4, bg='#000', fg='#0f0', font=('Consolas', 8))
         self.log_box.pack(fill=tk.X, padx=10, pady=5)
         sys.stdout = RedirectText(self.log_box)
+        self._apply_analysis_mode()
         
         keyboard.add_hotkey('f5', self.do_scan)
         keyboard.add_hotkey('f9', self.toggle_auto)
@@ -499,6 +761,7 @@ class GUI:
         
         self.running = False
         self.draw_board()
+        self.draw_analysis()
     
     def draw_board(self):
         self.canvas.delete("all")
@@ -529,6 +792,42 @@ class GUI:
                     self.canvas.create_oval(30+c*cw-22, 30+r*ch-22, 30+c*cw+22, 30+r*ch+22, fill=bg, outline='#000')
                     self.canvas.create_text(30+c*cw, 30+r*ch, text=disp, font=('SimSun', 18, 'bold'), fill='#000')
 
+    def draw_analysis(self):
+        """Top engine lines of the last search and Red's win-probability graph"""
+        analysis = self.bot.analysis  # One snapshot: start_game may swap it meanwhile
+        search = analysis.latest()
+        self.lines_box.delete('1.0', tk.END)
+        if search:
+            for rec in search.top_lines()[:ANALYSIS_MULTIPV]:
+                pv = " ".join(rec.pv[:8])
+                self.lines_box.insert(tk.END, f"{rec.multipv}. {rec.score_str():>7}  d{rec.depth:<2} {pv}\n")
+        
+        g = self.graph
+        g.delete("all")
+        w, h, pad = 540, 60, 5
+        g.create_line(0, h/2, w, h/2, fill='#444', dash=(2, 2))
+        count, probs = analysis.win_probs()
+        if not probs:
+            g.create_text(w/2, h/2, text="No analysis yet", fill='#666', font=('Consolas', 9))
+            return
+        
+        # X axis is the timeline index (our move number), gaps stay gaps
+        step = (w - 2*pad) / max(count - 1, 1)
+        points = []
+        for i, p, _ in probs:
+            points += [pad + i*step, pad + (1 - p) * (h - 2*pad)]
+        if len(points) >= 4:
+            g.create_line(*points, fill='#e63946', width=2)
+        x, y = points[-2], points[-1]
+        g.create_oval(x-3, y-3, x+3, y+3, fill='#e63946', outline='')
+        
+        # Mark positions where the engine would have wanted more time
+        for i, p, unstable in probs:
+            if unstable:
+                cx, cy = pad + i*step, pad + (1 - p) * (h - 2*pad)
+                g.create_oval(cx-2, cy-2, cx+2, cy+2, fill='#ffff00', outline='')
+        g.create_text(w - pad, pad, anchor='ne', text=f"Red {probs[-1][1]*100:.0f}%", fill='#ddd', font=('Consolas', 9))
+
     def do_scan(self):
         """Manual or forced full scan"""
         self.status.config(text="SCANNING BOARD...", fg='#ffff00')
@@ -549,16 +848,20 @@ class GUI:
                 self.status.config(text="BOARD EMPTY! SCAN FIRST.", fg='#ff0000')
                 self.do_scan()
 
+            self.bot.start_game()
+            self.draw_analysis()
+
             self.running = True
             self.play_btn.config(state=tk.DISABLED)
             self.stop_btn.config(state=tk.NORMAL)
             threading.Thread(target=self.auto_loop, daemon=True).start()
 
-    def stop_bot(self):
+    def stop_bot(self, result="STOPPED"):
         self.running = False
         self.play_btn.config(state=tk.NORMAL)
         self.stop_btn.config(state=tk.DISABLED)
         self.status.config(text="STOPPED", fg='#ffff00')
+        self.bot.finish_game(result)
  
     def log(self, message):
         self.log_box.insert(tk.END, message + "\n")
@@ -573,6 +876,23 @@ class GUI:
         else:
             self.top_btn.config(text="Stay on Top: OFF", bg='#444')
 
+    def toggle_analysis(self):
+        """Toggle deep analysis mode (MultiPV lines at the cost of search depth)"""
+        self.bot.engine.analysis_mode = not self.bot.engine.analysis_mode
+        self._apply_analysis_mode()
+
+    def _apply_analysis_mode(self):
+        """Show the analysis panel only while analysis mode is on"""
+        if self.bot.engine.analysis_mode:
+            self.analysis_btn.config(text=f"Analysis: ON ({ANALYSIS_MULTIPV} PV)", bg='#5c5cff')
+            self.analysis_frame.pack(fill=tk.X, padx=10, pady=(5, 0), before=self.log_box)
+            self.root.geometry("560x940")
+            self.draw_analysis()
+        else:
+            self.analysis_btn.config(text="Analysis: OFF", bg='#444')
+            self.analysis_frame.pack_forget()
+            self.root.geometry("560x820")
+
     def show_end_game(self, result):
         """Display win/loss message on canvas and stop bot"""
         color = "#00ff00" if result == "WIN" else "#ff0000"
@@ -583,8 +903,10 @@ class GUI:
         self.root.update()
         
         time.sleep(2)
+        self.bot.finish_game(result)
         self.stop_bot()
         self.draw_board()
+        self.draw_analysis()
 
     # smh
     def auto_loop(self):
@@ -614,6 +936,7 @@ class GUI:
                     elif move:
                         self.bot.execute_move(*move)
                         self.draw_board()
+                        self.draw_analysis()
                         our_turn = False
                         time.sleep(AUTO_PLAY_DELAY)
                     else:
@@ -637,7 +960,7 @@ class GUI:
                         our_turn = True
             except Exception as e:
                 messagebox.showerror("Bot Error", f"An error occurred: {str(e)}")
-                self.stop_bot()
+                self.stop_bot("ERROR")
 
 def main():
     run_as_admin()